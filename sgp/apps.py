@@ -1,6 +1,11 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class SgpConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sgp'
+
+    def ready(self):
+        from .forms import _reiniciar_permisos_proyecto
+        post_migrate.connect(_reiniciar_permisos_proyecto)
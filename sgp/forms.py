@@ -9,13 +9,45 @@ que para su clase base.
 """
 
 import datetime
+from collections import defaultdict
 
 from django import forms
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 from django.forms import ModelForm
 from django.utils import timezone
-from guardian.shortcuts import assign_perm, remove_perm, get_perms_for_model
 
-from .models import User, Proyecto, Role, Sprint, UserStory, Comentario, ParticipaSprint
+from .models import User, Proyecto, Role, Sprint, UserStory, Comentario, Participa, ParticipaSprint
+
+
+PERMISOS_USER = ('crear_proyecto', 'administrar', 'auditar')
+"""Permisos globales que pueden asignarse a un usuario desde UserForm."""
+
+_PERMISOS_PROYECTO = None
+
+
+def _permisos_proyecto():
+    # los permisos de proyecto no cambian en tiempo de ejecución, por lo que
+    # se consultan una sola vez y se reutilizan en cada formulario
+    global _PERMISOS_PROYECTO
+    if _PERMISOS_PROYECTO is None:
+        _PERMISOS_PROYECTO = tuple(Permission.objects.filter(content_type=ContentType.objects.get_for_model(Proyecto))
+                                   .exclude(codename='vista'))
+    return _PERMISOS_PROYECTO
+
+
+def _permiso_proyecto(codename):
+    for perm in _permisos_proyecto():
+        if perm.codename == codename:
+            return perm
+    raise Permission.DoesNotExist('No existe el permiso de proyecto ' + codename + '.')
+
+
+def _reiniciar_permisos_proyecto(**kwargs):
+    global _PERMISOS_PROYECTO
+    _PERMISOS_PROYECTO = None
 
 
 class UserForm(ModelForm):
@@ -41,15 +73,54 @@ class UserForm(ModelForm):
 
     def __init__(self, *args, **kwargs):
         super(UserForm, self).__init__(*args, **kwargs)
-        for permiso in self.Meta.fields:
-            self.fields[permiso].initial = self.instance.has_perm('sgp.' + permiso)
+        # los permisos se obtienen una sola vez y quedan en la caché del usuario
+        permisos = self.instance.get_all_permissions()
+        for permiso in PERMISOS_USER:
+            self.fields[permiso].initial = 'sgp.' + permiso in permisos
+
+    @classmethod
+    def preload(cls, usuarios):
+        """
+        Carga los permisos globales de todos los usuarios del queryset en dos
+        consultas y los guarda en la caché de permisos de cada instancia, para
+        que los formularios del formset no consulten la base de datos por cada
+        usuario. Los superusuarios se omiten, ya que poseen todos los permisos.
+
+        Los permisos se guardan en las instancias del queryset, por lo que se
+        debe pasar al formset el mismo objeto ``usuarios`` ya evaluado por este
+        método; una copia como ``usuarios.all()`` vuelve a consultar la base de
+        datos y pierde la precarga.
+
+        :param usuarios: Los usuarios que se mostrarán en el formset.
+        :type usuarios: QuerySet
+
+        |
+        """
+        usuarios = [usuario for usuario in usuarios if not usuario.is_superuser]
+        pks = [usuario.pk for usuario in usuarios]
+        permisos_usuario = defaultdict(set)
+        permisos_grupo = defaultdict(set)
+        for usuario, app_label, codename in User.user_permissions.through.objects.filter(user__in=pks) \
+                .values_list('user_id', 'permission__content_type__app_label', 'permission__codename'):
+            permisos_usuario[usuario].add(app_label + '.' + codename)
+        for usuario, app_label, codename in Group.permissions.through.objects.filter(group__user__in=pks) \
+                .values_list('group__user', 'permission__content_type__app_label', 'permission__codename'):
+            permisos_grupo[usuario].add(app_label + '.' + codename)
+        for usuario in usuarios:
+            usuario._user_perm_cache = permisos_usuario[usuario.pk]
+            usuario._group_perm_cache = permisos_grupo[usuario.pk]
+            usuario._perm_cache = usuario._user_perm_cache | usuario._group_perm_cache
 
     def save(self, commit=True):
-        for permiso in ['crear_proyecto', 'administrar', 'auditar']:
-            if self.cleaned_data[permiso]:
-                assign_perm('sgp.' + permiso, self.instance)
-            else:
-                remove_perm('sgp.' + permiso, self.instance)
+        permisos = Permission.objects.filter(content_type=ContentType.objects.get_for_model(User),
+                                             codename__in=PERMISOS_USER)
+        with transaction.atomic():
+            # solo se escriben los permisos que cambiaron, en una sola consulta por operación
+            actuales = set(self.instance.user_permissions.filter(pk__in=permisos))
+            self.instance.user_permissions.remove(
+                *[p for p in permisos if not self.cleaned_data[p.codename] and p in actuales])
+            self.instance.user_permissions.add(
+                *[p for p in permisos if self.cleaned_data[p.codename] and p not in actuales])
         super(UserForm, self).save(commit)
 
     class Meta:
@@ -76,7 +147,7 @@ class ProyectoForm(ModelForm):
     duracion_sprint = forms.IntegerField(label="Duración de los sprints (en días)", min_value=0)
 
     def __init__(self, *args, **kwargs):
-        super(ModelForm, self).__init__(*args, **kwargs)
+        super().__init__(*args, **kwargs)
         if self.instance.pk:
             if self.instance.estado == Proyecto.Estado.INICIADO:
                 self.fields['fecha_inicio'].initial = self.instance.fecha_inicio
@@ -93,25 +164,24 @@ class ProyectoForm(ModelForm):
 
         |
         """
-        cleaned_data = super(ModelForm, self).clean()
+        cleaned_data = super().clean()
 
         fecha_inicio = cleaned_data.get('fecha_inicio')
         fecha_fin = cleaned_data.get('fecha_fin')
         duracion_sprint = cleaned_data.get('duracion_sprint')
 
-        if fecha_inicio and fecha_inicio < timezone.localdate():
+        hoy = timezone.localdate()
+        if fecha_inicio and fecha_inicio < hoy:
             self.add_error('fecha_inicio', 'La fecha de inicio no puede ser en el pasado.')
             fecha_inicio = None
-        if fecha_fin and fecha_fin < timezone.localdate():
+        if fecha_fin and fecha_fin < hoy:
             self.add_error('fecha_fin', 'La fecha de fin no puede ser en el pasado.')
             fecha_fin = None
-        if fecha_inicio and fecha_fin and fecha_inicio > fecha_fin:
-            self.add_error('fecha_fin', 'La fecha de fin debe ser después de la fecha de inicio.')
-            fecha_inicio = None
-            fecha_fin = None
-        if fecha_inicio and fecha_fin and duracion_sprint and \
-                fecha_inicio + datetime.timedelta(days=duracion_sprint) > fecha_fin:
-            self.add_error('duracion_sprint', 'El proyecto debe tener tiempo para al menos un sprint.')
+        if fecha_inicio and fecha_fin:
+            if fecha_inicio > fecha_fin:
+                self.add_error('fecha_fin', 'La fecha de fin debe ser después de la fecha de inicio.')
+            elif duracion_sprint and (fecha_fin - fecha_inicio).days < duracion_sprint:
+                self.add_error('duracion_sprint', 'El proyecto debe tener tiempo para al menos un sprint.')
 
         return cleaned_data
 
@@ -153,29 +223,29 @@ class RoleForm(ModelForm):
     def __init__(self, *args, rol_actual, **kwargs):
         super(RoleForm, self).__init__(*args, **kwargs)
         if self.instance.pk:
-            permisos = get_perms_for_model(Proyecto).exclude(codename='vista')
+            permisos = _permisos_proyecto()
+            permisos_rol = {perm.id for perm in self.instance.permisos.all()}
             for perm in permisos:
-                self.fields[perm.codename].initial = self.instance.permisos.filter(id=perm.id).exists()
+                self.fields[perm.codename].initial = perm.id in permisos_rol
             self.rol_actual = rol_actual
             if self.instance == rol_actual:
                 self.fields['administrar_equipo'].disabled = True
 
     def save(self, commit=True):
-        permisos = get_perms_for_model(Proyecto).exclude(codename='vista')
+        permisos = _permisos_proyecto()
         if self.instance.pk:
             if self.instance == self.rol_actual:
                 self.cleaned_data['administrar_equipo'] = True
-            for perm in permisos:
-                if self.cleaned_data[perm.codename]:
-                    self.instance.asignar_permiso(perm)
-                else:
-                    self.instance.quitar_permiso(perm)
+            # solo se actualizan los permisos que cambiaron
+            permisos_rol = set(self.instance.permisos.all())
+            self.instance.asignar_permisos(
+                [perm for perm in permisos if self.cleaned_data[perm.codename] and perm not in permisos_rol])
+            self.instance.quitar_permisos(
+                [perm for perm in permisos if not self.cleaned_data[perm.codename] and perm in permisos_rol])
             super(RoleForm, self).save(commit)
         else:
             super(RoleForm, self).save(commit)
-            for perm in permisos:
-                if self.cleaned_data[perm.codename]:
-                    self.instance.permisos.add(perm)
+            self.instance.permisos.add(*[perm for perm in permisos if self.cleaned_data[perm.codename]])
 
     class Meta:
         model = Role
@@ -207,27 +277,28 @@ class UserRoleForm(ModelForm):
     """
 
     borrar = forms.BooleanField(required=False)
+    rol = forms.ModelChoiceField(queryset=Role.objects.none())
 
     def __init__(self, *args, usuario_actual, proyecto_actual, **kwargs):
         super(UserRoleForm, self).__init__(*args, **kwargs)
 
         if self.instance == usuario_actual:
-            perm = get_perms_for_model(Proyecto).get(codename='administrar_equipo')
-            queryset = Role.objects.filter(proyecto=proyecto_actual, permisos__in=[perm])
+            perm = _permiso_proyecto('administrar_equipo')
+            queryset = Role.objects.filter(proyecto=proyecto_actual, permisos__in=[perm]) \
+                .only('id', 'nombre').order_by('nombre')
             self.fields['borrar'].disabled = True
             self.borrar_string = 'Usuario actual'
         else:
-            queryset = Role.objects.filter(proyecto=proyecto_actual)
+            queryset = Role.objects.filter(proyecto=proyecto_actual).only('id', 'nombre').order_by('nombre')
             if proyecto_actual.sprint_activo and self.instance in proyecto_actual.sprint_activo.equipo.all():
                 self.fields['borrar'].disabled = True
                 self.borrar_string = 'Ocupado en sprint'
 
-        initial = self.instance.participa_set.get(proyecto=proyecto_actual).rol
+        # se recorre participa_set.all() para aprovechar la consulta precargada por la vista
+        initial = next((p.rol for p in self.instance.participa_set.all() if p.proyecto_id == proyecto_actual.id), None)
         self.nombre_rol = str(initial)
-        self.fields['rol'] = forms.ModelChoiceField(
-            queryset=queryset,
-            initial=initial,
-        )
+        self.fields['rol'].queryset = queryset
+        self.fields['rol'].initial = initial
         self.fields['nombre'].disabled = True
         self.fields['apellido'].disabled = True
         self.fields['email'].disabled = True
@@ -242,7 +313,7 @@ class UserRoleForm(ModelForm):
 
         |
         """
-        cleaned_data = super(ModelForm, self).clean()
+        cleaned_data = super().clean()
         if cleaned_data.get('borrar'):
             self.proyecto_actual.quitar_rol(self.instance)
         return cleaned_data
@@ -277,9 +348,10 @@ class AgregarMiembroForm(forms.Form):
         self.proyecto = proyecto
         super().__init__(*args, **kwargs)
         self.fields['usuarios'] = forms.ModelChoiceField(
-            queryset=User.objects.exclude(participa__proyecto=proyecto).exclude(pk='AnonymousUser'))
+            queryset=User.objects.filter(~Exists(Participa.objects.filter(usuario=OuterRef('pk'), proyecto=proyecto)))
+            .exclude(pk='AnonymousUser').only('user_id', 'nombre', 'apellido', 'email'))
         self.fields['roles'] = forms.ModelChoiceField(
-            queryset=Role.objects.filter(proyecto=proyecto))
+            queryset=Role.objects.filter(proyecto=proyecto).only('id', 'nombre'))
 
     def save(self):
         self.proyecto.asignar_rol(self.cleaned_data['usuarios'], self.cleaned_data['roles'].nombre)
@@ -297,9 +369,6 @@ class UploadFileForm(forms.Form):
     """
     archivo = forms.FileField()
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
 
 class UserStoryForm(ModelForm):
     """
@@ -325,7 +394,7 @@ class UserStoryForm(ModelForm):
     """
 
     def __init__(self, *args, usuario=None, proyecto=None, **kwargs):
-        super(ModelForm, self).__init__(*args, **kwargs)
+        super().__init__(*args, **kwargs)
         self.proyecto = proyecto
         if usuario:
             if not usuario.has_perm('gestionar_proyecto', proyecto):
@@ -341,7 +410,7 @@ class UserStoryForm(ModelForm):
         self.instance.proyecto = self.proyecto
         if not self.instance.pk:
             self.instance.numero = UserStory.objects.filter(proyecto=self.proyecto).count() + 1
-        super(ModelForm, self).save(commit)
+        super().save(commit)
 
     class Meta:
         model = UserStory
@@ -362,7 +431,7 @@ class ComentarioForm(ModelForm):
     |
     """
     def __init__(self, *args, usuario=None, user_story=None, **kwargs):
-        super(ModelForm, self).__init__(*args, **kwargs)
+        super().__init__(*args, **kwargs)
         self.usuario = usuario
         self.user_story = user_story
 
@@ -370,7 +439,7 @@ class ComentarioForm(ModelForm):
         self.instance.user_story = self.user_story
         self.instance.autor = self.usuario
         self.instance.fecha = timezone.localdate()
-        super(ModelForm, self).save(commit)
+        super().save(commit)
 
     class Meta:
         model = Comentario
@@ -402,7 +471,7 @@ class SprintForm(ModelForm):
     fecha_fin = forms.DateField(label="Fecha de fin", disabled=True, required=False)
 
     def __init__(self, *args, proyecto=None, **kwargs):
-        super(ModelForm, self).__init__(*args, **kwargs)
+        super().__init__(*args, **kwargs)
         self.proyecto = proyecto
         if not self.instance.pk:
             self.fields['duracion'].initial = proyecto.duracion_sprint
@@ -417,7 +486,7 @@ class SprintForm(ModelForm):
 
         |
         """
-        cleaned_data = super(ModelForm, self).clean()
+        cleaned_data = super().clean()
 
         fecha_inicio = cleaned_data.get('fecha_inicio')
         duracion = cleaned_data.get('duracion')
@@ -435,7 +504,7 @@ class SprintForm(ModelForm):
 
     def save(self, commit=True):
         self.instance.proyecto = self.proyecto
-        super(ModelForm, self).save(commit)
+        super().save(commit)
 
     class Meta:
         model = Sprint
@@ -480,7 +549,7 @@ class BacklogForm(ModelForm):
 
         |
         """
-        cleaned_data = super(ModelForm, self).clean()
+        cleaned_data = super().clean()
         if not cleaned_data.get('prioridad'):
             cleaned_data['prioridad'] = self.instance.prioridad
         if not cleaned_data.get('horas_estimadas'):
@@ -595,7 +664,7 @@ class UserSprintForm(ModelForm):
 
         |
         """
-        cleaned_data = super(ModelForm, self).clean()
+        cleaned_data = super().clean()
         if cleaned_data.get('borrar'):
             self.participa.delete()
             if cleaned_data.get('horas'):
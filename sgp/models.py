@@ -7,8 +7,10 @@ import datetime
 
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin, Group, Permission
+from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
-from guardian.shortcuts import assign_perm, get_perms_for_model, remove_perm
+from guardian.models import UserObjectPermission
+from guardian.shortcuts import assign_perm, remove_perm
 
 
 class UserManager(BaseUserManager):
@@ -165,7 +167,7 @@ class Proyecto(models.Model):
         :param user: El usuario al que se le revocará el rol.
         :type user: User
         """
-        participa = user.participa_set.get(proyecto=self)
+        participa = user.participa_set.select_related('rol').get(proyecto=self)
         for perm in participa.rol.permisos.all():
             remove_perm(perm.codename, user, self)
         participa.delete()
@@ -178,12 +180,13 @@ class Proyecto(models.Model):
         :param permisos: Los permisos del rol a ser creado.
         :type nombre: string
         :type permisos: [string]"""
+        perms = list(Permission.objects.filter(content_type=ContentType.objects.get_for_model(Proyecto),
+                                               codename__in=permisos))
+        faltantes = set(permisos) - {perm.codename for perm in perms}
+        if faltantes:
+            raise Permission.DoesNotExist('No existen los permisos de proyecto: ' + ', '.join(sorted(faltantes)))
         rol = Role.objects.create(nombre=nombre, proyecto=self)
-        perms = get_perms_for_model(Proyecto)
-        for perm in permisos:
-            rol.permisos.add(perms.get(codename=perm))
-            rol.permisos.add(perms.get(codename=perm))
-            rol.permisos.add(perms.get(codename=perm))
+        rol.permisos.add(*perms)
 
     def crear_roles_predeterminados(self):
         """
@@ -305,18 +308,40 @@ class Role(models.Model):
     def asignar_permiso(self, permiso):
         """Asigna un permiso al rol y a todos los usuarios que forman parte de
         él."""
-        self.permisos.add(permiso)
-        for p in self.participa_set.select_related('usuario'):
-            assign_perm(permiso, p.usuario, self.proyecto)
+        self.asignar_permisos([permiso])
 
     def quitar_permiso(self, permiso):
         """Quita un permiso al rol y a todos los usuarios que forman parte de
-        él.
+        él."""
+        self.quitar_permisos([permiso])
+
+    def asignar_permisos(self, permisos):
+        """Asigna un conjunto de permisos al rol y a todos los usuarios que
+        forman parte de él. Los permisos de todos los usuarios se insertan en
+        una sola consulta."""
+        if not permisos:
+            return
+        self.permisos.add(*permisos)
+        ctype = ContentType.objects.get_for_model(Proyecto)
+        usuarios = self.participa_set.values_list('usuario_id', flat=True)
+        UserObjectPermission.objects.bulk_create(
+            [UserObjectPermission(user_id=usuario, permission=permiso, content_type=ctype,
+                                  object_pk=str(self.proyecto_id))
+             for usuario in usuarios for permiso in permisos],
+            ignore_conflicts=True)
+
+    def quitar_permisos(self, permisos):
+        """Quita un conjunto de permisos al rol y a todos los usuarios que
+        forman parte de él. Los permisos de todos los usuarios se eliminan en
+        una sola consulta.
 
         |"""
-        self.permisos.remove(permiso)
-        for p in self.participa_set.select_related('usuario'):
-            remove_perm(permiso, p.usuario, self.proyecto)
+        if not permisos:
+            return
+        self.permisos.remove(*permisos)
+        UserObjectPermission.objects.filter(
+            user__in=self.participa_set.values('usuario_id'), permission__in=permisos,
+            content_type=ContentType.objects.get_for_model(Proyecto), object_pk=str(self.proyecto_id)).delete()
 
     def __str__(self):
         return self.nombre
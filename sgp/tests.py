@@ -10,12 +10,15 @@ Las pruebas se encuentran agrupadas en clases según que componente evalúan.
 """
 import datetime
 
+from django.contrib.auth.models import Permission
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from guardian.shortcuts import assign_perm, get_perms_for_model
 
 from .forms import ProyectoForm, UserStoryForm, ComentarioForm, SprintForm, \
-    AgregarDesarrolladorForm, AgregarUserStoryForm
+    AgregarDesarrolladorForm, AgregarUserStoryForm, UserForm, RoleForm
 from .models import Proyecto, User, UserStory, Comentario, Sprint, ParticipaSprint, Role
 
 
@@ -97,6 +100,38 @@ class NavigationTest(TestCase):
                          "La página de edición de proyecto retornó un error HTTP")
 
 
+class AdministrarTest(TestCase):
+
+    def consultas_administrar(self):
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(reverse('sgp:administrar'))
+        self.assertEqual(response.status_code, 200)
+        return len(consultas.captured_queries)
+
+    def test_consultas_administrar(self):
+        """
+        Verifica que el número de consultas de la página de administración no
+        crezca con el número de usuarios, gracias a UserForm.preload.
+
+        **Fecha:** 15/10/26
+
+        **Artefacto:** Módulo de seguridad
+
+        |
+        """
+        for i in range(1, 3):
+            user = User.objects.create(user_id=i, email=str(i) + '@fpuna.edu.py',
+                                       nombre='Nombre', apellido='Apellido')
+            assign_perm('sgp.crear_proyecto', user)
+        consultas = self.consultas_administrar()
+        for i in range(3, 8):
+            user = User.objects.create(user_id=i, email=str(i) + '@fpuna.edu.py',
+                                       nombre='Nombre', apellido='Apellido')
+            assign_perm('sgp.auditar', user)
+        self.assertEqual(self.consultas_administrar(), consultas,
+                         "La página de administración realiza consultas por cada usuario.")
+
+
 class PermissionTest(TestCase):
 
     def test_otorgar_permisos(self):
@@ -195,6 +230,164 @@ class PermissionTest(TestCase):
         user.delete()
         proj.delete()
 
+    def test_crear_rol_permiso_inexistente(self):
+        """
+        Verifica que crear un rol con un permiso inexistente genere un error
+        sin crear el rol.
+
+        **Fecha:** 15/10/26
+
+        **Artefacto:** Módulo de proyecto
+
+        |
+        """
+        proj = Proyecto.objects.create(nombre='Proyecto de prueba')
+        with self.assertRaises(Permission.DoesNotExist):
+            proj.crear_rol('Rol de prueba', ['desarrollo', 'noexiste'])
+        self.assertFalse(proj.role_set.filter(nombre='Rol de prueba').exists(),
+                         "Se creó el rol a pesar de tener un permiso inexistente.")
+
+    def test_permisos_de_rol(self):
+        """
+        Verifica que RoleForm otorgue y revoque los permisos de un rol a todos
+        sus miembros, sin escribir en la base de datos los permisos que no
+        cambiaron.
+
+        **Fecha:** 15/10/26
+
+        **Artefacto:** Módulo de proyecto
+
+        |
+        """
+        proj = Proyecto.objects.create(nombre='Proyecto de prueba')
+        proj.crear_roles_predeterminados()
+        usuarios = [User.objects.create(user_id=i, email=str(i) + '@fpuna.edu.py', nombre='Nombre',
+                                        apellido='Apellido') for i in range(1, 3)]
+        for user in usuarios:
+            proj.asignar_rol(user, 'Desarrollador')
+        rol = proj.role_set.get(nombre='Desarrollador')
+        rol_actual = proj.role_set.get(nombre='Scrum master')
+
+        form = RoleForm(instance=rol, rol_actual=rol_actual,
+                        data={'nombre': 'Desarrollador', 'desarrollo': True, 'pila_producto': True})
+        self.assertTrue(form.is_valid(), "El formulario no es válido")
+        form.save()
+        for user in usuarios:
+            user = User.objects.get(pk=user.pk)
+            self.assertTrue(user.has_perm('pila_producto', proj), "El miembro no recibió el permiso otorgado.")
+            self.assertTrue(user.has_perm('desarrollo', proj), "El miembro perdió un permiso no modificado.")
+
+        form = RoleForm(instance=Role.objects.get(pk=rol.pk), rol_actual=rol_actual,
+                        data={'nombre': 'Desarrollador', 'desarrollo': True})
+        self.assertTrue(form.is_valid(), "El formulario no es válido")
+        with CaptureQueriesContext(connection) as consultas:
+            form.save()
+        for user in usuarios:
+            user = User.objects.get(pk=user.pk)
+            self.assertFalse(user.has_perm('pila_producto', proj), "El miembro aún tiene el permiso revocado.")
+            self.assertTrue(user.has_perm('desarrollo', proj), "El miembro perdió un permiso no modificado.")
+        escrituras = [c['sql'].split(' WHERE')[0] for c in consultas.captured_queries
+                      if c['sql'].startswith(('INSERT', 'DELETE'))]
+        self.assertEqual(escrituras, ['DELETE FROM "sgp_role_permisos"', 'DELETE FROM "guardian_userobjectpermission"'],
+                         "Se escribieron permisos que no cambiaron.")
+
+    def test_permisos_de_usuario(self):
+        """
+        Verifica que UserForm otorgue y revoque los permisos globales del
+        usuario.
+
+        **Fecha:** 15/10/26
+
+        **Artefacto:** Módulo de seguridad
+
+        |
+        """
+        user = User.objects.create(
+            user_id=1,
+            email='ejemplo@fpuna.edu.py',
+            nombre='Nombre',
+            apellido='Apellido')
+        assign_perm('sgp.auditar', user)
+        form = UserForm(instance=user, data={'nombre': 'Nombre', 'apellido': 'Apellido',
+                                             'crear_proyecto': True, 'administrar': True})
+        self.assertTrue(form.is_valid(), "El formulario no es válido")
+        form.save()
+        user = User.objects.get(user_id=1)
+        self.assertTrue(user.has_perm('sgp.crear_proyecto'), "El usuario no tiene el permiso otorgado.")
+        self.assertTrue(user.has_perm('sgp.administrar'), "El usuario no tiene el permiso otorgado.")
+        self.assertFalse(user.has_perm('sgp.auditar'), "El usuario aún tiene el permiso revocado.")
+
+        form = UserForm(instance=user, data={'nombre': 'Nombre', 'apellido': 'Apellido',
+                                             'crear_proyecto': True, 'administrar': True})
+        self.assertTrue(form.is_valid(), "El formulario no es válido")
+        with CaptureQueriesContext(connection) as consultas:
+            form.save()
+        self.assertFalse([c for c in consultas.captured_queries if c['sql'].startswith(('INSERT', 'DELETE'))],
+                         "Se escribieron permisos que no cambiaron.")
+
+    def test_precarga_permisos(self):
+        """
+        Verifica que UserForm.preload cargue los permisos de los usuarios de
+        modo que los formularios no realicen consultas adicionales.
+
+        **Fecha:** 15/10/26
+
+        **Artefacto:** Módulo de seguridad
+
+        |
+        """
+        user = User.objects.create(
+            user_id=1,
+            email='ejemplo@fpuna.edu.py',
+            nombre='Nombre',
+            apellido='Apellido')
+        assign_perm('sgp.crear_proyecto', user)
+        usuarios = User.objects.filter(user_id=1)
+        UserForm.preload(usuarios)
+        with self.assertNumQueries(0):
+            form = UserForm(instance=usuarios[0])
+        self.assertTrue(form.fields['crear_proyecto'].initial, "El permiso otorgado no fue cargado.")
+        self.assertFalse(form.fields['auditar'].initial, "Se cargó un permiso no otorgado.")
+
+
+class EquipoTest(TestCase):
+
+    def setUp(self):
+        self.proyecto = Proyecto.objects.create(nombre='Proyecto de prueba')
+        self.proyecto.crear_roles_predeterminados()
+        for user_id, rol in [('1', 'Scrum master'), ('2', 'Desarrollador'), ('3', 'Interesado')]:
+            user = User.objects.create(user_id=user_id, email=user_id + '@test.com',
+                                       nombre='Nombre', apellido='Apellido')
+            self.proyecto.asignar_rol(user, rol)
+        self.client.login(token='1', test=True)
+
+    def test_post_invalido_muestra_equipo_actual(self):
+        """
+        Verifica que, si el formulario de equipo es inválido, la página vuelva
+        a mostrar el equipo actual sin los miembros que fueron quitados.
+
+        **Fecha:** 15/10/26
+
+        **Artefacto:** Módulo de proyecto
+
+        |
+        """
+        miembros = list(User.objects.filter(participa__proyecto=self.proyecto).order_by('participa__rol'))
+        data = {'asignar_roles': '', 'form-TOTAL_FORMS': len(miembros), 'form-INITIAL_FORMS': len(miembros),
+                'form-MIN_NUM_FORMS': 0, 'form-MAX_NUM_FORMS': 1000}
+        for i, miembro in enumerate(miembros):
+            data['form-%d-user_id' % i] = miembro.pk
+            data['form-%d-rol' % i] = miembro.participa_set.get(proyecto=self.proyecto).rol_id
+        data['form-1-borrar'] = 'on'
+        data['form-2-rol'] = 0
+        response = self.client.post(reverse('sgp:administrar_equipo', kwargs={'proyecto_id': self.proyecto.id}),
+                                    data)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.proyecto.participa_set.filter(usuario_id='2').exists(),
+                         "El usuario no fue quitado del equipo.")
+        self.assertEqual([form.instance.pk for form in response.context['formset']], ['1', '3'],
+                         "La página muestra miembros que ya no forman parte del equipo.")
+
 
 class CrearProyectoTest(TestCase):
 
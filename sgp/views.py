@@ -10,16 +10,17 @@ A continuación se documentan todas las vistas de la aplicación SGP.
 import datetime
 import json
 
-from django.db.models import Sum
+from django.db.models import Prefetch, Sum
 from django.forms import modelformset_factory
 from django.shortcuts import render
 from django.http import HttpResponse, HttpResponseRedirect
 from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth.models import Permission
 from django.urls import reverse
 from django.utils import timezone
 from guardian.shortcuts import get_objects_for_user
 
-from .models import User, Proyecto, Role, Sprint, UserStory, Incremento
+from .models import User, Proyecto, Role, Sprint, UserStory, Incremento, Participa
 from .forms import ProyectoForm, UserForm, RoleForm, UserRoleForm, AgregarMiembroForm, UploadFileForm, SprintForm, \
     UserStoryForm, ComentarioForm, AgregarUserStoryForm, AgregarDesarrolladorForm, UserSprintForm, BacklogForm
 from .utils import render_to_pdf, enviar_notificacion
@@ -99,8 +100,11 @@ def administrar(request):
     |
     """
     UserFormSet = modelformset_factory(User, form=UserForm, extra=0, can_delete=True)
+    # el formset debe recibir este mismo queryset para aprovechar la precarga
+    usuarios = User.objects.exclude(user_id='AnonymousUser').order_by('fecha_registro')
+    UserForm.preload(usuarios)
     if request.method == 'POST':
-        formset = UserFormSet(request.POST)
+        formset = UserFormSet(request.POST, queryset=usuarios)
         if formset.is_valid():
             formset.save()
             for form in formset:
@@ -108,7 +112,7 @@ def administrar(request):
                     return HttpResponseRedirect(reverse('sgp:administrar'))
             return HttpResponseRedirect(reverse('sgp:index'))
     else:
-        formset = UserFormSet(queryset=User.objects.exclude(user_id='AnonymousUser').order_by('fecha_registro'))
+        formset = UserFormSet(queryset=usuarios)
     return render(request, 'sgp/administrar.html', {'formset': formset})
 
 
@@ -234,10 +238,12 @@ def administrar_roles(request, proyecto_id):
     proyecto = Proyecto.objects.get(pk=proyecto_id)
     rol = Role.objects.get(proyecto=proyecto, participa__usuario=request.user)
     RoleFormSet = modelformset_factory(Role, form=RoleForm, extra=0, can_delete=True)
+    roles = Role.objects.filter(proyecto=proyecto_id).prefetch_related(
+        Prefetch('permisos', queryset=Permission.objects.only('id', 'codename')))
 
     # Si el request es de tipo POST, procesar los roles recibidos
     if request.method == 'POST':
-        formset = RoleFormSet(request.POST, form_kwargs={'rol_actual': rol})
+        formset = RoleFormSet(request.POST, queryset=roles, form_kwargs={'rol_actual': rol})
 
         # Si uno de los roles es nuevo, apuntarlo al proyecto actual
         for form in formset:
@@ -251,7 +257,7 @@ def administrar_roles(request, proyecto_id):
 
     # Si el request es de tipo GET, enviar una lista de roles
     else:
-        formset = RoleFormSet(queryset=Role.objects.filter(proyecto=proyecto_id),
+        formset = RoleFormSet(queryset=roles,
                               form_kwargs={'rol_actual': rol})
 
     return render(request, 'sgp/proyecto-roles.html',
@@ -277,8 +283,6 @@ def importar_roles(request, proyecto_id):
         roles = json.load(request.FILES['archivo'])
         for rol in roles:
             proyecto.crear_rol(rol['nombre'], rol['permisos'])
-    else:
-        print(form)
     return HttpResponseRedirect(reverse('sgp:administrar_roles', kwargs={'proyecto_id': proyecto_id}))
 
 
@@ -303,7 +307,6 @@ def exportar_roles(request, proyecto_id):
             perms.append(perm.codename)
         rol['permisos'] = perms
         roles.append(rol)
-    print(json.dumps(roles))
     response = HttpResponse(json.dumps(roles), content_type='application/json')
     response['Content-Disposition'] = 'attachment; filename=roles-proyecto-'+str(proyecto_id)+'.json'
     return response
@@ -330,6 +333,9 @@ def administrar_equipo(request, proyecto_id):
     proyecto = Proyecto.objects.get(pk=proyecto_id)
     usuario = request.user
     UserRoleFormSet = modelformset_factory(User, form=UserRoleForm, extra=0, can_delete=True)
+    miembros = User.objects.filter(participa__proyecto=proyecto_id).order_by('participa__rol').prefetch_related(
+        Prefetch('participa_set', queryset=Participa.objects.filter(proyecto=proyecto).select_related('rol')
+                 .only('id', 'usuario', 'proyecto', 'rol__id', 'rol__nombre')))
 
     # Si se agregó un nuevo miembro al equipo, registrarlo
     if 'agregar_usuario' in request.POST:
@@ -343,7 +349,7 @@ def administrar_equipo(request, proyecto_id):
 
     # Si se modificaron los roles de los miembros, procesar los cambios
     if 'asignar_roles' in request.POST:
-        formset = UserRoleFormSet(request.POST,
+        formset = UserRoleFormSet(request.POST, queryset=miembros,
                                   form_kwargs={'usuario_actual': usuario, 'proyecto_actual': proyecto})
         if formset.is_valid():
             formset.save()
@@ -358,9 +364,10 @@ def administrar_equipo(request, proyecto_id):
             return HttpResponseRedirect(reverse('sgp:mostrar_proyecto',
                                                 kwargs={'proyecto_id': proyecto_id}))
 
-    # Enviar una lista de miembros
+    # Enviar una lista de miembros; se usa una copia del queryset porque el
+    # formset del POST pudo haberlo evaluado antes de que se quitaran miembros
     formset = UserRoleFormSet(
-        queryset=User.objects.filter(participa__proyecto=proyecto_id).order_by('participa__rol'),
+        queryset=miembros.all(),
         form_kwargs={'usuario_actual': usuario, 'proyecto_actual': proyecto})
 
     return render(request, 'sgp/proyecto-equipo.html',